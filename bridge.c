@@ -11,7 +11,14 @@
 
 #include "bridge.h"
 
-struct callbacks python_callbacks = {NULL};
+/* Per-call state of bridge_main(), passed to fuse_main() as its user_data.
+ * 'paths' is an optional sorted list of every path in the filesystem, or
+ * NULL if any path might exist. */
+struct bridge_state {
+    struct callbacks callbacks;
+    char **paths;
+    size_t path_count;
+};
 
 /*----------------------------------------------------------------------------*/
 
@@ -20,6 +27,11 @@ void *zalloc(size_t size)
     return calloc(1, size);
 }
 
+void *ualloc(size_t size)
+{
+    return malloc(size);
+}
+
 void zfree(void *ptr)
 {
     free(ptr);
@@ -63,17 +75,47 @@ static void unload_attributes(const struct file_attributes *in,
 
 /*----------------------------------------------------------------------------*/
 
+/* Returns the state of the running bridge_main() call. Each FUSE loop has
+ * its own. This is a thread-local lookup inside libfuse, so each op does
+ * it once and passes the result along. */
+static const struct bridge_state *get_state(void)
+{
+    return fuse_get_context()->private_data;
+}
+
+static int compare_paths(const void *a, const void *b)
+{
+    return strcmp(*(char *const *)a, *(char *const *)b);
+}
+
+static bool path_is_known(const struct bridge_state *state, const char *path)
+{
+    if (state->paths == NULL) {
+        return true;
+    }
+
+    return bsearch(&path, state->paths, state->path_count,
+                   sizeof(*state->paths), compare_paths) != NULL;
+}
+
+/*----------------------------------------------------------------------------*/
+
 static int bridge_open(const char *path, struct fuse_file_info *fi)
 {
+    const struct bridge_state *state = get_state();
     int retval;
     struct file_info info = {0};
 
-    if (python_callbacks.open == NULL) {
+    if (state->callbacks.open == NULL) {
         return -EPERM;
     }
 
+    if (!path_is_known(state, path)) {
+        return -ENOENT;
+    }
+
     load_file_info(fi, &info);
-    retval = python_callbacks.open(path, &info);
+    retval = state->callbacks.open(path, &info);
     unload_file_info(&info, fi);
 
     return retval;
@@ -85,14 +127,19 @@ static int bridge_readdir(const char *path, void *buf,
                           fuse_fill_dir_t filler, off_t offset,
                           struct fuse_file_info *fi)
 {
+    const struct bridge_state *state = get_state();
     int retval;
     char **entries = NULL;
 
-    if (python_callbacks.readdir == NULL) {
+    if (state->callbacks.readdir == NULL) {
         return -EPERM;
     }
 
-    retval = python_callbacks.readdir(path, &entries);
+    if (!path_is_known(state, path)) {
+        return -ENOENT;
+    }
+
+    retval = state->callbacks.readdir(path, &entries);
 
     if (entries == NULL) {
         return -ENOENT;
@@ -103,25 +150,29 @@ static int bridge_readdir(const char *path, void *buf,
             retval = -EIO;
             break;
         }
-        free(entries[x]);
     }
 
-    free(entries);
+    zfree(entries);
     return retval;
 }
 #pragma GCC diagnostic pop
 
 static int bridge_getattr(const char *path, struct stat *stbuf)
 {
+    const struct bridge_state *state = get_state();
     int retval;
     struct file_attributes attributes = {0};
 
-    if (python_callbacks.getattr == NULL) {
+    if (state->callbacks.getattr == NULL) {
         return -EPERM;
     }
 
+    if (!path_is_known(state, path)) {
+        return -ENOENT;
+    }
+
     load_attributes(stbuf, &attributes);
-    retval = python_callbacks.getattr(path, &attributes);
+    retval = state->callbacks.getattr(path, &attributes);
 
     if (retval != -ENOENT) {
         stbuf->st_nlink = 1;
@@ -133,25 +184,34 @@ static int bridge_getattr(const char *path, struct stat *stbuf)
 
 static int bridge_access(const char* path, int mask)
 {
-    if (python_callbacks.access == NULL) {
-        return -EPERM;
+    const struct bridge_state *state = get_state();
+
+    /* state->callbacks.access is never NULL here: bridge_main() leaves
+     * access out of the operations table when Python lacks it. */
+    if (!path_is_known(state, path)) {
+        return -ENOENT;
     }
 
-    return python_callbacks.access(path, mask);
+    return state->callbacks.access(path, mask);
 }
 
 static int bridge_read(const char *path, char *buf, size_t size,
                        off_t offset, struct fuse_file_info *fi)
 {
+    const struct bridge_state *state = get_state();
     int retval;
     struct file_info info = {0};
 
-    if (python_callbacks.read == NULL) {
+    if (state->callbacks.read == NULL) {
         return -EPERM;
     }
 
+    if (!path_is_known(state, path)) {
+        return -ENOENT;
+    }
+
     load_file_info(fi, &info);
-    retval = python_callbacks.read(path, buf, size, offset, &info);
+    retval = state->callbacks.read(path, buf, size, offset, &info);
     unload_file_info(&info, fi);
 
     return retval;
@@ -159,31 +219,42 @@ static int bridge_read(const char *path, char *buf, size_t size,
 
 static int bridge_truncate(const char* path, off_t size)
 {
-    if (python_callbacks.truncate == NULL) {
+    const struct bridge_state *state = get_state();
+
+    if (state->callbacks.truncate == NULL) {
         return -EPERM;
     }
 
-    return python_callbacks.truncate(path, size);
+    if (!path_is_known(state, path)) {
+        return -ENOENT;
+    }
+
+    return state->callbacks.truncate(path, size);
 }
 
 static int bridge_write(const char *path, const char *buf, size_t size,
                         off_t offset, struct fuse_file_info *fi)
 {
+    const struct bridge_state *state = get_state();
     int retval;
     struct file_info info = {0};
 
-    if (python_callbacks.write == NULL) {
+    if (state->callbacks.write == NULL) {
         return -EPERM;
     }
 
+    if (!path_is_known(state, path)) {
+        return -ENOENT;
+    }
+
     load_file_info(fi, &info);
-    retval = python_callbacks.write(path, buf, size, offset, &info);
+    retval = state->callbacks.write(path, buf, size, offset, &info);
     unload_file_info(&info, fi);
 
     return retval;
 }
 
-static struct fuse_operations bridge_oper = {
+static const struct fuse_operations bridge_oper = {
     .getattr = bridge_getattr,
     .readdir = bridge_readdir,
     .truncate = bridge_truncate,
@@ -193,13 +264,31 @@ static struct fuse_operations bridge_oper = {
     .access = bridge_access
 };
 
-int bridge_main(int argc, char *argv[])
+int bridge_main(int argc, char *argv[], const struct callbacks *callbacks,
+                char *paths[])
 {
-    int result = fuse_main(argc, argv, &bridge_oper, NULL);
-    for (int x = 0; x < argc; x++) {
-        zfree(argv[x]);
+    int result;
+    struct fuse_operations oper = bridge_oper;
+    struct bridge_state state = {*callbacks, paths, 0};
+
+    /* Sorted once here, so that every lookup is a binary search. */
+    if (paths != NULL) {
+        while (paths[state.path_count] != NULL) {
+            state.path_count++;
+        }
+        qsort(paths, state.path_count, sizeof(*paths), compare_paths);
     }
 
+    /* Without a Python access callback, access is left out entirely, so
+     * libfuse replies -ENOSYS (which the kernel caches) without a
+     * round-trip into Python. */
+    if (state.callbacks.access == NULL) {
+        oper.access = NULL;
+    }
+
+    result = fuse_main(argc, argv, &oper, &state);
+
+    zfree(paths);
     zfree(argv);
     return result;
 }
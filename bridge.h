@@ -35,7 +35,9 @@ typedef int (*python_open_ptr)(const char *path, struct file_info *info);
  * 
  * The 'entries' record should be pointed to a 2-D array (created
  * by Python). The Python function that supplies this should use
- * bridge.c's zalloc() function to allocate all memory. */
+ * one of bridge.c's allocators (zalloc() or ualloc()) to allocate the
+ * pointer table and the strings as one block, which is released with a
+ * single zfree() after the entries have been passed to FUSE. */
 
 typedef int (*python_readdir_ptr)(const char *path, char ***entries);
 
@@ -92,10 +94,29 @@ struct callbacks {
 
 /*--------------------------------------------------------------------*/
 
-extern struct callbacks python_callbacks;
-int bridge_main(int argc, char *argv[]);
+/* Launches fuse_main(). 'argv' should be a single ualloc() block holding
+ * both the pointer table and the strings, and is freed before returning.
+ * 'callbacks' is copied on entry (each call keeps its own copy, handed to
+ * the ops through fuse_main()'s user_data), so changes made to it while the
+ * loop is running have no effect. The function pointers it holds must stay
+ * valid until bridge_main() returns. A NULL access entry leaves access to
+ * libfuse; other NULL entries make their op fail with -EPERM.
+ *
+ * 'paths' optionally lists every path in the filesystem, for filesystems
+ * with a fixed tree. It's a NULL-terminated block laid out like 'argv',
+ * in any order. Its pointer table is sorted in place (so lookups are a
+ * binary search), and it's also freed before returning. Ops on any other
+ * path get -ENOENT without calling into Python. Pass NULL if any path
+ * might exist. */
+
+int bridge_main(int argc, char *argv[], const struct callbacks *callbacks,
+                char *paths[]);
+
+/* zalloc() returns zeroed memory. ualloc() skips the zeroing, for callers
+ * that overwrite the whole block anyway. Both are released with zfree(). */
 
 void *zalloc(size_t size);
+void *ualloc(size_t size);
 void zfree(void *ptr);
 
 /*--------------------------------------------------------------------*/
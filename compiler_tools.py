@@ -8,6 +8,10 @@ allocator (supplied by bridge.c) to create a 2-D string array (for use
 in the readdir callback. """
 
 import ast
+import functools
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
 import subprocess as sp
 import shlex
 import shutil
@@ -16,18 +20,152 @@ import re
 import sys
 import os
 
+_DEFINE_RE = re.compile(r"^[ \t]*#define[ \t]+(?!_)([^ (\t]+)[ \t]+"
+                        r"(.*?)[ \t]*$", re.M)
+_INTEGER_RE = re.compile(r"^(0[xX][0-9a-fA-F]+|[0-9]+)[uUlL]*$")
+_LITERAL_RE = re.compile(r"\b(0[xX][0-9a-fA-F]+|[0-9]+)([uUlL]*)\b")
+_EXPANSION_RE = re.compile(r'^__pyfuse_value__ "([A-Za-z0-9_]+)" = (.*)$',
+                           re.M)
 
-def compile_library(files=(), libname="temp"):
-    """ Compiles a set of files into a shared library in a new temp directory.
-    Returns the path to the new library.
+_INT_MIN = -2 ** 31
+_INT_MAX = 2 ** 31 - 1
+
+_BINARY_OPS = {ast.Add: lambda a, b: a + b,
+               ast.Sub: lambda a, b: a - b,
+               ast.Mult: lambda a, b: a * b,
+               ast.LShift: lambda a, b: a << b,
+               ast.RShift: lambda a, b: a >> b,
+               ast.BitOr: lambda a, b: a | b,
+               ast.BitAnd: lambda a, b: a & b,
+               ast.BitXor: lambda a, b: a ^ b}
+
+_UNARY_OPS = {ast.USub: lambda a: -a,
+              ast.UAdd: lambda a: a,
+              ast.Invert: lambda a: ~a}
+
+
+def cache_dir():
+    """ Returns the directory used for pyfuse's persistent on-disk cache.
+    Honors XDG_CACHE_HOME, and falls back to ~/.cache otherwise.
+
+    Returns:
+        string: Path to the (possibly not-yet-created) cache directory. """
+
+    base = os.environ.get("XDG_CACHE_HOME", "")
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+
+    return os.path.join(base, "pyfuse")
+
+
+def is_cached(path):
+    """ Checks whether a path lives inside of pyfuse's on-disk cache (and
+    should therefore be left alone when cleaning up temp files).
+
+    Args:
+        path (string): Path to check.
+
+    Returns:
+        bool: True if the path is inside of the cache directory. """
+
+    root = os.path.abspath(cache_dir())
+    return os.path.abspath(path).startswith(root + os.sep)
+
+
+@functools.lru_cache(maxsize=8)
+def _cc_invocation(cc_env, cflags_env, default_cc=("cc",), default_cflags=()):
+    """ Parses the CC and CFLAGS environment variables into argument tuples.
+    Memoized, since every compiler helper needs them.
+
+    Args:
+        cc_env (string): Value of CC, or None if unset.
+        cflags_env (string): Value of CFLAGS, or None if unset.
+        default_cc (tuple): Compiler command to use if CC is unset.
+        default_cflags (tuple): Flags to use if CFLAGS is unset.
+
+    Returns:
+        tuple: (cc_cmd, cflags) as tuples of strings. """
+
+    cc_cmd = tuple(shlex.split(cc_env)) if cc_env else tuple(default_cc)
+
+    if cflags_env is None:
+        cflags = tuple(default_cflags)
+    else:
+        cflags = tuple(shlex.split(cflags_env))
+
+    return cc_cmd, cflags
+
+
+@functools.lru_cache(maxsize=None)
+def _compiler_version(cc_cmd):
+    """ Returns the output of '<cc> --version' followed by '<cc> -dumpmachine'
+    (the target triple, since a version string alone doesn't tell two
+    architectures apart). Queries that fail contribute an empty string.
+    Memoized, so each compiler command is only queried once per process
+    ('cc_cmd' must be a tuple). """
+
+    output = b""
+
+    for flag in ("--version", "-dumpmachine"):
+        try:
+            output += sp.check_output(list(cc_cmd) + [flag],
+                                      stdin=sp.DEVNULL, stderr=sp.DEVNULL)
+        except (FileNotFoundError, sp.CalledProcessError):
+            pass
+
+    return output
+
+
+def _library_key(files, cc_cmd, cflags):
+    """ Computes the cache key for a library build. The key covers the
+    contents of every input file, the compiler command, the compiler flags,
+    and the compiler's reported version and target. """
+
+    digest = hashlib.sha256()
+
+    for filename in files:
+        with open(filename, "rb") as infile:
+            digest.update(infile.read())
+        digest.update(b"\x00")
+
+    digest.update(" ".join(cc_cmd).encode() + b"\x00")
+    digest.update(" ".join(cflags).encode() + b"\x00")
+    digest.update(_compiler_version(tuple(cc_cmd)))
+    return digest.hexdigest()
+
+
+def compile_library(files=(), libname="temp", depends=(), pgo=None,
+                    pgo_generate=False, dev=False):
+    """ Compiles a set of files into a shared library, and returns the path
+    to the new library.
 
     This is accomplished by using the local C compiler ('cc' or the CC
     environment variable) and CFLAGS (if defined in the environment) to compile
     the provided file set.
 
+    Finished libraries are kept in a persistent cache (see cache_dir()), keyed
+    by a hash of the sources, the compiler and its flags. If a matching library
+    is already in the cache, it's returned without invoking the compiler. If
+    the cache directory isn't usable, the library is built into a new temp
+    directory instead (which the caller is responsible for deleting).
+
     Args:
         files (tuple): List of files to #include in the library.
         libname (string): Name of generated library file.
+        depends (tuple): Extra files (such as headers) that aren't passed to
+                         the compiler, but should invalidate the cache when
+                         they change.
+        pgo (string): Optional directory for GCC profile data (GCC 11 or
+                      newer). By default, the profile found there is used to
+                      build the library with -fprofile-use, -flto and -O3,
+                      and every file in it becomes part of the cache key.
+        pgo_generate (bool): Build an instrumented library instead, which
+                             writes its profile into 'pgo' when the
+                             process that loaded it exits.
+        dev (bool): Build with strict warnings (-Wall -Wextra -pedantic
+                    -Werror). Meant for working on the C sources; off by
+                    default so that new compiler warnings can't break
+                    users' builds. Ignored if CFLAGS is set.
 
     Returns:
         string: The path to generated library file. """
@@ -35,21 +173,27 @@ def compile_library(files=(), libname="temp"):
     if isinstance(files, str):
         files = (files,)
 
+    if isinstance(depends, str):
+        depends = (depends,)
+
+    # GCC's profile checksums include the source path, so keep it stable.
+    files = [os.path.abspath(x) for x in files]
+
     base = os.path.split(sys.argv[0])[1]
-    tempdir = tempfile.mkdtemp(prefix="tmp.%s." % base)
     outfile = "lib%s.so" % libname
-    outfile = os.path.join(tempdir, outfile)
 
-    if "CC" in os.environ:
-        cc_cmd = shlex.split(os.environ["CC"])
-    else:
-        cc_cmd = ["cc"]
+    default_cflags = ("-O2",)
 
-    if "CFLAGS" in os.environ:
-        cflags = shlex.split(os.environ["CFLAGS"])
-    else:
-        cflags = ["-O2", "-Wall", "-Wextra", "-Wno-missing-field-initializers",
-                  "-pedantic"]
+    if dev:
+        default_cflags += ("-Wall", "-Wextra",
+                           "-Wno-missing-field-initializers", "-pedantic",
+                           "-Werror")
+
+    cc_cmd, cflags = _cc_invocation(os.environ.get("CC"),
+                                    os.environ.get("CFLAGS"),
+                                    default_cflags=default_cflags)
+    cc_cmd = list(cc_cmd)
+    cflags = list(cflags)
 
     cflags += ["-D_FILE_OFFSET_BITS=64", "-fPIC", "-shared"]
 
@@ -61,9 +205,44 @@ def compile_library(files=(), libname="temp"):
     else:
         fuselib = "fuse"
 
+    depends = list(depends)
+
+    if pgo:
+        # GCC names profile files after the output path. Pinning the dump
+        # prefix inside 'pgo' keeps that name the same no matter which temp
+        # directory the library is built in.
+        pgo = os.path.abspath(pgo)
+        cflags += ["-dumpdir", os.path.join(pgo, outfile + "-")]
+
+    if pgo and pgo_generate:
+        cflags += ["-fprofile-generate=" + pgo]
+    elif pgo:
+        cflags += ["-fprofile-use=" + pgo, "-fprofile-correction", "-flto",
+                   "-O3"]
+        for root, _, names in sorted(os.walk(pgo)):
+            depends += [os.path.join(root, x) for x in sorted(names)]
+
+    key = _library_key(list(files) + depends, cc_cmd, cflags)
+    cached = os.path.join(cache_dir(), key, outfile)
+
+    if os.path.isfile(cached):
+        return cached
+
+    try:
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+    except OSError:
+        cached = None
+
+    if cached:
+        tempdir = tempfile.mkdtemp(prefix="tmp.%s." % base,
+                                   dir=os.path.dirname(cached))
+    else:
+        tempdir = tempfile.mkdtemp(prefix="tmp.%s." % base)
+
+    outfile = os.path.join(tempdir, outfile)
     command = cc_cmd + cflags + list(files) + ["-l" + fuselib, "-o", outfile]
     try:
-        result = sp.call(command)
+        result = sp.run(command, stdin=sp.DEVNULL).returncode
     except FileNotFoundError:
         result = 127
 
@@ -75,12 +254,18 @@ def compile_library(files=(), libname="temp"):
         sys.stderr.write(err_msg + "\n")
         sys.exit(result)
 
-    return outfile
+    if cached is None:
+        return outfile
 
+    os.replace(outfile, cached)
+    shutil.rmtree(tempdir, ignore_errors=True)
+    return cached
 
-def find_constant_names(header_filename, regex=".*"):
-    """ Finds all the names of all #define constants in the target header.
-    Does not retrieve their value.
+
+def find_constant_definitions(header_filename, regex=".*"):
+    """ Finds all #define constants in the target header, along with the
+    text of their definitions (as reported by the preprocessor). Definitions
+    aren't evaluated, so they may refer to other macros.
 
     Args:
         header_filename (string): Header file to scan for constants.
@@ -88,23 +273,16 @@ def find_constant_names(header_filename, regex=".*"):
                         to all constants.
 
     Returns:
-        tuple: Tuple of detected constant names (as strings) """
+        dict: A name-indexed dict of definition strings. """
 
-    if "CC" in os.environ:
-        cc_cmd = shlex.split(os.environ["CC"])
-    else:
-        cc_cmd = ["cc"]
-
-    if "CFLAGS" in os.environ:
-        cflags = shlex.split(os.environ["CFLAGS"])
-    else:
-        cflags = []
+    cc_cmd, cflags = _cc_invocation(os.environ.get("CC"),
+                                    os.environ.get("CFLAGS"))
 
     base = os.path.split(sys.argv[0])[1]
-    command = cc_cmd + cflags + ["-E", "-dM", header_filename]
+    command = list(cc_cmd + cflags) + ["-E", "-dM", header_filename]
 
     try:
-        result = sp.check_output(command).decode().strip()
+        result = sp.check_output(command, stdin=sp.DEVNULL).decode()
     except (FileNotFoundError, sp.CalledProcessError) as error:
         command = shlex.quote(' '.join(command))
         err_msg = "%s: Pre-parser couldn't execute command: %s)"
@@ -116,20 +294,215 @@ def find_constant_names(header_filename, regex=".*"):
         else:
             sys.exit(error.returncode)
 
-    define_regex = "^[ \t]*[#]define[ \t]+[^ (\t]+[ \t]+"
+    user_re = re.compile(regex)
+    matches = (match.groups() for match in _DEFINE_RE.finditer(result))
+    return {name: definition for name, definition in matches
+            if user_re.search(name)}
+
+
+def find_constant_names(header_filename, regex=".*"):
+    """ Finds all the names of all #define constants in the target header.
+    Does not retrieve their value.
+
+    Args:
+        header_filename (string): Header file to scan for constants.
+        regex (string): Regex to match against detected constants. Defaults
+                        to all constants.
+
+    Returns:
+        tuple: Tuple of detected constant names (as strings) """
+
+    return tuple(find_constant_definitions(header_filename, regex))
+
+
+def parse_integer_literal(text):
+    """ Parses a C integer literal (decimal, octal or hex, with an optional
+    U/L suffix).
+
+    Args:
+        text (string): Literal to parse, such as '0x10UL'.
+
+    Returns:
+        int: The literal's value, or None if 'text' isn't an integer
+             literal. """
+
+    match = _INTEGER_RE.match(text.strip())
+
+    if not match:
+        return None
+
+    digits = match.group(1)
+
+    if digits[:2] in ("0x", "0X"):
+        return int(digits, 16)
+
+    if len(digits) > 1 and digits[0] == "0":
+        try:
+            return int(digits, 8)
+        except ValueError:
+            return None
 
-    matches = re.findall(define_regex, result, flags=re.M)
-    result = [x.strip().split() for x in matches]
-    result = [x[1].strip() for x in result]
-    result = [x for x in result if x[:1] != "_"]
+    return int(digits)
 
-    return tuple([x for x in result if re.search(regex, x)])
+
+def _evaluate_node(node):
+    """ Recursively evaluates an expression tree from evaluate_expression().
+    Raises ValueError for anything that isn't plain int arithmetic, or that
+    leaves the range of a C int (where C and Python would disagree). """
+
+    if isinstance(node, ast.Expression):
+        return _evaluate_node(node.body)
+
+    if isinstance(node, ast.Constant) and type(node.value) is int:
+        value = node.value
+    elif isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        value = _UNARY_OPS[type(node.op)](_evaluate_node(node.operand))
+    elif isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+        left = _evaluate_node(node.left)
+        right = _evaluate_node(node.right)
+
+        if isinstance(node.op, (ast.LShift, ast.RShift)) and \
+                not 0 <= right < 32:
+            raise ValueError("shift out of range")
+
+        value = _BINARY_OPS[type(node.op)](left, right)
+    else:
+        raise ValueError("unsupported expression")
+
+    if not _INT_MIN <= value <= _INT_MAX:
+        raise ValueError("value out of range")
+
+    return value
+
+
+def evaluate_expression(text):
+    """ Evaluates a preprocessed C constant expression in Python. Only
+    integer literals, parentheses, and the + - * << >> | & ^ ~ operators are
+    supported, and every value along the way has to fit in a C int.
+
+    Args:
+        text (string): Expression to evaluate, such as '(1 << 4) | 0x02'.
+
+    Returns:
+        int: The expression's value, or None if it can't be evaluated
+             safely in Python (casts, sizeof, unsigned literals, etc). """
+
+    def literal(match):
+        """ Replaces a C integer literal with its decimal value. """
+
+        if "u" in match.group(2).lower():
+            raise ValueError("unsigned literal")
+
+        value = parse_integer_literal(match.group(1))
+
+        if value is None:
+            raise ValueError("bad literal")
+
+        return str(value)
+
+    try:
+        text = _LITERAL_RE.sub(literal, text.strip())
+        return _evaluate_node(ast.parse(text, mode="eval"))
+    except (ValueError, SyntaxError, TypeError):
+        return None
+
+
+def evaluate_constants(includes=(), constants=()):
+    """ Runs a list of constants through the preprocessor (with a user-supplied
+    list of include files), and evaluates their expansions in Python with
+    evaluate_expression(). This resolves constants that are defined in terms
+    of other macros without having to compile or run anything.
+
+    Args:
+        includes (tuple/list): List of files to #include before expansion.
+        constants (tuple/list): List of constants to expand and evaluate.
+
+    Returns:
+        dict: A name-index dict containing the constants that could be
+              evaluated. Constants that couldn't be are left out. """
+
+    if isinstance(includes, str):
+        includes = (includes,)
+
+    cc_cmd, cflags = _cc_invocation(os.environ.get("CC"),
+                                    os.environ.get("CFLAGS"))
+
+    source = ['#include "%s"' % x for x in includes]
+    source += ['__pyfuse_value__ "%s" = (%s)' % (x, x) for x in constants]
+    source = '\n'.join(source) + '\n'
+
+    command = list(cc_cmd + cflags) + ["-E", "-P", "-x", "c", "-"]
+
+    try:
+        result = sp.check_output(command, input=source.encode(),
+                                 stderr=sp.DEVNULL).decode()
+    except (FileNotFoundError, sp.CalledProcessError):
+        return {}
+
+    output = {}
+
+    for name, expansion in _EXPANSION_RE.findall(result):
+        value = evaluate_expression(expansion)
+
+        if value is not None:
+            output[name] = value
+
+    return output
+
+
+def _compile_and_run_memfd(source):
+    """ Linux-only version of _compile_and_run(). The binary is written
+    to an anonymous memory file (memfd_create) and executed from there,
+    so it never touches the filesystem. Compiler errors are silenced here,
+    since _compile_and_run() retries (and reports them) on failure. """
+
+    descriptor = os.memfd_create("pyfuse_probe")
+    binary = "/proc/%d/fd/%d" % (os.getpid(), descriptor)
+
+    try:
+        command = ["cc", "-x", "c", "-", "-o", binary]
+        sp.run(command, input=source.encode(), stderr=sp.DEVNULL, check=True)
+        return sp.check_output([binary], stdin=sp.DEVNULL).decode().strip()
+    finally:
+        os.close(descriptor)
+
+
+def _compile_and_run(source):
+    """ Compiles C source text into a program, runs it, and returns its
+    output. The source is fed to the compiler on stdin, so only the binary
+    needs a file. Raises CalledProcessError if either step fails. """
+
+    if hasattr(os, "memfd_create"):
+        try:
+            return _compile_and_run_memfd(source)
+        except (OSError, sp.CalledProcessError):
+            # Some systems refuse to run programs out of a memfd. Fall back
+            # to a regular file before giving up.
+            pass
+
+    descriptor, binary = tempfile.mkstemp(suffix='.bin')
+    os.close(descriptor)
+
+    try:
+        command = ["cc", "-x", "c", "-", "-o", binary]
+        sp.run(command, input=source.encode(), check=True)
+        os.chmod(binary, 0o700)
+        return sp.check_output([binary], stdin=sp.DEVNULL).decode().strip()
+    finally:
+        if os.path.isfile(binary):
+            os.remove(binary)
 
 
 def get_constant_values(includes=(), constants=()):
     """ Compiles a test C file with a user-specified list of include files.
     Test file will have one 'printf' call for each parameter in the constants
-    list. The result is parsed, and the constant values are returned as a dict.
+    list, which together print a single JSON object. The result is parsed,
+    and the constant values are returned as a dict.
+
+    Each printf() is wrapped in an #ifdef, so names that aren't macros are
+    skipped. If the test program still fails to build, the list is split in
+    half and each half is retried, so one bad constant doesn't cost the
+    rest.
 
     This is an easy way to use the system C compiler to achieve platform
     independence from specific constant values on any given system.
@@ -161,42 +534,125 @@ def get_constant_values(includes=(), constants=()):
     include_string = ['#include "%s"' % x for x in includes]
     include_string = '\n'.join(include_string)
 
-    line = 'printf("%NAME% = %lld\\n", (long long int)'
-    line += '(%NAME%));'
-    lines = [line.replace('%NAME%', x) for x in constants]
+    line = '#ifdef %NAME%\n'
+    line += 'printf("%s\\"%NAME%\\": %lld", sep, (long long int)(%NAME%));\n'
+    line += 'sep = ", ";\n'
+    line += '#endif'
+    lines = ['const char *sep = "";', 'printf("{");']
+
+    for name in constants:
+        lines.append(line.replace('%NAME%', name))
+
+    lines.append('printf("}\\n");')
 
     source = template.replace("%INCLUDES%", include_string)
     source = source.replace("%CONSTANT_LINES%", '\n'.join(lines))
 
-    descriptor, filename = tempfile.mkstemp(dir='.', suffix='.c')
-    binary = filename + '.bin'
-    os.write(descriptor, source.encode())
-    os.close(descriptor)
-
     try:
-        sp.check_call(["cc", filename, "-o", binary])
-        result = sp.check_output([binary]).decode().strip()
-
+        return json.loads(_compile_and_run(source))
     except sp.CalledProcessError:
-        result = ""
+        result = {}
 
-    for name in [binary, filename]:
-        if os.path.isfile(name):
-            os.remove(name)
+    if len(constants) > 1:
+        middle = len(constants) // 2
+        result.update(get_constant_values(includes, constants[:middle]))
+        result.update(get_constant_values(includes, constants[middle:]))
 
-    results = [pair.split('=') for pair in result.splitlines()]
-    output = {}
+    return result
 
-    for pair in results:
-        output[pair[0].strip()] = ast.literal_eval(pair[1].strip())
 
-    return output
+def _constants_cache_file(header, regex):
+    """ Returns the path of the on-disk cache file for a header/regex pair.
+    The name is a hash of the header's path and mtime, the regex, and the
+    compiler setup, so a libc upgrade or a different CC/CFLAGS misses the
+    cache. """
+
+    cc_cmd, _ = _cc_invocation(os.environ.get("CC"), None)
+
+    digest = hashlib.sha256()
+    digest.update(os.path.abspath(header).encode() + b"\x00")
+    digest.update(str(os.stat(header).st_mtime_ns).encode() + b"\x00")
+    digest.update(regex.encode() + b"\x00")
+    digest.update(os.environ.get("CC", "").encode() + b"\x00")
+    digest.update(os.environ.get("CFLAGS", "").encode() + b"\x00")
+    digest.update(_compiler_version(cc_cmd))
+
+    filename = "constants-%s.json" % digest.hexdigest()
+    return os.path.join(cache_dir(), filename)
+
+
+def _detect_constants(header, regex):
+    """ Uncached implementation of find_and_get_constants(). """
+
+    definitions = find_constant_definitions(header, regex)
+    value_dict = {}
+    unresolved = []
+
+    for name, definition in definitions.items():
+        value = parse_integer_literal(definition)
+
+        if value is None:
+            unresolved.append(name)
+        else:
+            value_dict[name] = value
+
+    if unresolved:
+        value_dict.update(evaluate_constants(header, unresolved))
+        unresolved = [x for x in unresolved if x not in value_dict]
+
+    if unresolved:
+        value_dict.update(get_constant_values(header, unresolved))
+
+    return value_dict
+
+
+@functools.lru_cache(maxsize=None)
+def _load_constants(header, regex, mtime):
+    """ Disk-cached implementation of find_and_get_constants(). The mtime
+    argument is only used as part of the in-process memo key, so that an
+    edited header is re-read. """
+
+    #pylint: disable=unused-argument
+    try:
+        cache_file = _constants_cache_file(header, regex)
+    except OSError:
+        return _detect_constants(header, regex)
+
+    try:
+        with open(cache_file) as infile:
+            return json.load(infile)
+    except (OSError, ValueError):
+        pass
+
+    value_dict = _detect_constants(header, regex)
+    cache_path = os.path.dirname(cache_file)
+
+    try:
+        os.makedirs(cache_path, exist_ok=True)
+        descriptor, tempname = tempfile.mkstemp(dir=cache_path)
+        with os.fdopen(descriptor, "w") as outfile:
+            json.dump(value_dict, outfile)
+        os.replace(tempname, cache_file)
+    except OSError:
+        pass
+
+    return value_dict
 
 
 def find_and_get_constants(header, regex=".*"):
     """ Finds all constants that match a regex inside of a given header
     file.
 
+    Constants that are defined as plain integer literals are read straight
+    from the preprocessor output. Ones that are defined in terms of other
+    macros are expanded and evaluated by evaluate_constants(). Only the
+    remaining ones (casts, sizeof, etc.) are compiled into a test program
+    by get_constant_values().
+
+    Results are cached on disk (see cache_dir()), so repeated lookups of an
+    unchanged header don't need to run the compiler at all. They are also
+    memoized in-process by (header, regex, mtime).
+
     The result is returned as a dict of values.
 
     Args:
@@ -206,9 +662,12 @@ def find_and_get_constants(header, regex=".*"):
     Returns:
         dict: A dict of detected constants. """
 
-    constants = find_constant_names(header, regex)
-    value_dict = get_constant_values(header, constants)
-    return value_dict
+    try:
+        mtime = os.stat(header).st_mtime_ns
+    except OSError:
+        mtime = None
+
+    return dict(_load_constants(header, regex, mtime))
 
 
 def find_errnos(header="/usr/include/errno.h"):
@@ -228,9 +687,18 @@ def find_errnos(header="/usr/include/errno.h"):
 
     return find_and_get_constants(header, "^E")
 
-ERRNO_CONSTANTS = find_and_get_constants("/usr/include/errno.h", "^E")
-FCNTL_CONSTANTS = find_and_get_constants("/usr/include/fcntl.h", "^[A-Z]")
-STAT_CONSTANTS = find_and_get_constants("/usr/include/sys/stat.h", "^[A-Z]")
+_CONSTANT_SPECS = (("/usr/include/errno.h", "^E"),
+                   ("/usr/include/fcntl.h", "^[A-Z]"),
+                   ("/usr/include/sys/stat.h", "^[A-Z]"))
+
+# Each lookup spends nearly all of its time waiting on cc, so they're run
+# side-by-side rather than one after another.
+with ThreadPoolExecutor(max_workers=len(_CONSTANT_SPECS)) as _executor:
+    _FUTURES = [_executor.submit(find_and_get_constants, *x)
+                for x in _CONSTANT_SPECS]
+
+ERRNO_CONSTANTS, FCNTL_CONSTANTS, STAT_CONSTANTS = [x.result()
+                                                    for x in _FUTURES]
 
 #------------------------------------------------------------------------------#
 
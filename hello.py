@@ -7,58 +7,73 @@ import os
 import compiler_tools as tools
 import pyfuse
 
+ENOENT = tools.ERRNO_CONSTANTS["ENOENT"]
+EACCES = tools.ERRNO_CONSTANTS["EACCES"]
+O_RDONLY = tools.FCNTL_CONSTANTS["O_RDONLY"]
+S_IFDIR = tools.STAT_CONSTANTS["S_IFDIR"]
+S_IFREG = tools.STAT_CONSTANTS["S_IFREG"]
+
 
 class HelloFs(pyfuse.BasicFs):
     """ Basic demonstration filesystem for Pyfuse bridge. """
 
+    bytes_paths = True
+
     def __init__(self):
         self.hello_str = "Hello World!\n"
-        self.hello_path = "/hello"
+        self.hello_data = self.hello_str.encode()
+        self.hello_path = b"/hello"
+        self.entries = (b".", b"..", self.hello_path[1:], b"moto")
+
+        # The tree never changes, so every path's attributes are built once
+        # here instead of on each getattr() call.
+        self.attributes = {
+            b"/": self._make_attributes(S_IFDIR | 0o755),
+            self.hello_path: self._make_attributes(S_IFREG | 0o666),
+            b"/moto": self._make_attributes(S_IFDIR | 0o755),
+            b"/moto/hello": self._make_attributes(S_IFREG | 0o444)}
+        self.known_paths = tuple(self.attributes)
+
         super(HelloFs, self).__init__()
 
+    @staticmethod
+    def _make_attributes(mode):
+        """ Builds a FileAttributes owned by the current user. """
+
+        attributes = pyfuse.FileAttributes()
+        attributes.uid = os.getuid()
+        attributes.gid = os.getgid()
+        attributes.size = 42
+        attributes.mode = mode
+        return attributes
+
     def open(self, path, info):
         if path != self.hello_path:
-            return -tools.ERRNO_CONSTANTS["ENOENT"]
+            return -ENOENT
 
-        if (info.flags & 0x03) != tools.FCNTL_CONSTANTS["O_RDONLY"]:
+        if (info.flags & 0x03) != O_RDONLY:
             print("This filesystem is read-only")
-            return -tools.ERRNO_CONSTANTS["EACCES"]
+            return -EACCES
 
         return 0
 
     def readdir(self, path):
-        return 0, [".", "..", self.hello_path[1:], "moto"]
+        return 0, self.entries
 
     def getattr(self, path):
-        attributes = pyfuse.FileAttributes()
-
-        attributes.uid = os.getuid()
-        attributes.gid = os.getgid()
-        attributes.size = 42
+        attributes = self.attributes.get(path)
 
-        if path == "/":
-            attributes.mode = tools.STAT_CONSTANTS["S_IFDIR"] | 0o755
-        elif path == self.hello_path:
-            attributes.mode = tools.STAT_CONSTANTS["S_IFREG"] | 0o666
-        elif path == "/moto":
-            attributes.mode = tools.STAT_CONSTANTS["S_IFDIR"] | 0o755
-        elif path == "/moto/hello":
-            attributes.mode = tools.STAT_CONSTANTS["S_IFREG"] | 0o444
-        else:
-            return -tools.ERRNO_CONSTANTS["ENOENT"]
+        if attributes is None:
+            return -ENOENT
 
         return 0, attributes
 
     def read(self, path, size, offset, info):
         if path != self.hello_path:
-            return -tools.ERRNO_CONSTANTS["ENOENT"], ""
-
-        length = len(self.hello_str)
-
-        if offset >= length:
-            return 0
+            return -ENOENT, ""
 
-        return size, self.hello_str[offset:offset + size]
+        data = self.hello_data[offset:offset + size]
+        return len(data), data
 
     def write(self, path, data, size, offset, info):
         #pylint: disable=too-many-arguments
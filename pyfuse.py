@@ -10,13 +10,15 @@ aspects of the the underlying fuse and stat structures.
 This library is under heavy development, and should be expected to change
 over time. """
 
+import argparse
+import atexit
 import time
-import multiprocessing
 import signal
 import sys
 import os
 import shutil
-import subprocess as sp
+import struct
+import weakref
 import ctypes as ct
 
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
@@ -46,6 +48,9 @@ class FileAttributes(ct.Structure):
                 ("gid", ct.c_uint32)]
 
 
+ATTRIBUTES_SIZE = ct.sizeof(FileAttributes)
+
+
 #pylint: disable=invalid-name
 OpenPtrType = ct.CFUNCTYPE(ct.c_int, ct.c_char_p, ct.POINTER(FileInfo))
 AllocPtrType = ct.CFUNCTYPE(ct.c_void_p, ct.c_size_t)
@@ -81,6 +86,25 @@ class Callbacks(ct.Structure):
                 ("truncate", TruncatePtrType)]
 
 
+# Prototypes for every function exported by bridge.c, as name:
+# (argtypes, restype). Declaring them up-front lets ctypes use its fixed
+# converters instead of guessing argument types on every call.
+EXTERN_SIGNATURES = {"zalloc": ([ct.c_size_t], ct.c_void_p),
+                     "ualloc": ([ct.c_size_t], ct.c_void_p),
+                     "zfree": ([ct.c_void_p], None),
+                     "bridge_main": ([ct.c_int, ct.c_void_p,
+                                      ct.POINTER(Callbacks), ct.c_void_p],
+                                     ct.c_int),
+                     "debug_write": ([ct.c_char_p], ct.c_int)}
+
+
+# Finds the mount point in a FUSE command line. Only '-o' takes a value, and
+# everything else is left for fuse_main() to parse (and validate).
+MOUNT_ARGS = argparse.ArgumentParser(add_help=False, exit_on_error=False)
+MOUNT_ARGS.add_argument("-o", action="append")
+MOUNT_ARGS.add_argument("mountpoint", nargs="?")
+
+
 def register_signal_callback(callback, signum):
     """ Registers a callback with the main process's signal handlers. This
     can be used to do any last-minute clean-up before handling a SIGINT or
@@ -102,15 +126,38 @@ def register_signal_callback(callback, signum):
     signal.signal(signum, handler)
 
 
+# Per-function [calls, total nanoseconds], filled in by @profiler.
+PROFILE_STATS = {}
+
+
+def _print_profile():
+    """ Prints a summary of everything recorded by @profiler. """
+
+    for name, (calls, total) in sorted(PROFILE_STATS.items()):
+        if not calls:
+            continue
+
+        print("%s: %d calls, %.4f sec total, %.1f usec/call" %
+              (name, calls, total / 1e9, total / calls / 1e3))
+
+
 def profiler(target):
-    """ Decorator for use in profiling code. Runs the decorated function
-    and prints the run-time. """
+    """ Decorator for use in profiling code. Accumulates the call count and
+    run-time of the decorated function (with perf_counter_ns(), which is
+    fine-grained enough for short callbacks), and prints a summary when
+    the interpreter exits. """
+
+    if not PROFILE_STATS:
+        atexit.register(_print_profile)
+
+    stats = PROFILE_STATS.setdefault(target.__name__, [0, 0])
 
     def wrapper(*args, **kwargs):
         #pylint: disable=missing-docstring
-        start = time.time()
+        start = time.perf_counter_ns()
         result = target(*args, **kwargs)
-        print("%s ran in: %.4f sec" % (target.__name__, time.time() - start))
+        stats[1] += time.perf_counter_ns() - start
+        stats[0] += 1
         return result
 
     return wrapper
@@ -122,29 +169,76 @@ class FuseBridge(object):
     connecting callbacks, and launching main() with any arguments that
     should be passed down to fuse_main. """
 
-    def __init__(self):
-        srcfile = os.path.join(os.path.dirname(__file__), "bridge.c")
-        self.bridge_lib = tools.compile_library(srcfile)
-        self.extern = ct.cdll.LoadLibrary(self.bridge_lib)
+    # Compiled and loaded bridge libraries, shared by every instance in the
+    # process. dlopen() hands back the same library for the same path anyway,
+    # so this only skips re-hashing the sources and re-binding signatures.
+    _libraries = {}
 
-        self.extern.zalloc.restype = ct.c_void_p
-        self.extern.zalloc.argtypes = [ct.c_size_t]
-        self.extern.zfree.argtypes = [ct.c_void_p]
-        self.extern.bridge_main.restype = ct.c_int
-        self.extern.bridge_main.argtypes = [ct.c_int, ct.c_void_p]
-
-        self.callbacks = Callbacks.in_dll(self.extern, 'python_callbacks')
+    def __init__(self):
+        srcdir = os.path.dirname(__file__)
+        srcfile = os.path.join(srcdir, "bridge.c")
+        header = os.path.join(srcdir, "bridge.h")
+
+        # PYFUSE_PROFILE_DIR builds the bridge with the GCC profile found
+        # there. Setting PYFUSE_PROFILE_GENERATE=1 as well loads an
+        # instrumented bridge instead, which records a new profile into
+        # that directory when the process exits.
+        profile = os.environ.get("PYFUSE_PROFILE_DIR") or None
+        generate = bool(profile) and \
+            os.environ.get("PYFUSE_PROFILE_GENERATE") == "1"
+        self.bridge_lib, self.extern = self._load_library(srcfile, header,
+                                                          profile, generate)
+
+        self.callbacks = Callbacks()
         self.result = None
-        self.process = None
-        self.mount_point = ''
+        self.mount_point = None
+
+        # FUSE runs single-threaded ('-s') by default, so every callback
+        # arrives on the thread that called main(). libfuse's own worker
+        # threads have no Python thread state, so ctypes builds and tears
+        # one down on every callback from them (microseconds per call),
+        # and the GIL serializes the Python work anyway. Clear this to
+        # let libfuse dispatch from several threads.
+        self.single_threaded = True
+
+        # Filesystems with a fixed tree can list every path here. Ops on
+        # any other path are then answered with -ENOENT by the bridge,
+        # without a round-trip into Python.
+        self.known_paths = None
+
+    @classmethod
+    def _load_library(cls, srcfile, header, profile, generate=False):
+        """ Compiles (or finds a cached copy of) the bridge library and loads
+        it, once per process. Returns a (path, CDLL) tuple. """
+
+        key = (srcfile, profile, generate)
+        if key in cls._libraries:
+            return cls._libraries[key]
+
+        bridge_lib = tools.compile_library(srcfile, depends=header,
+                                           pgo=profile, pgo_generate=generate)
+        extern = ct.cdll.LoadLibrary(bridge_lib)
+
+        for name, (argtypes, restype) in EXTERN_SIGNATURES.items():
+            function = getattr(extern, name)
+            function.argtypes = argtypes
+            function.restype = restype
+
+        # One-off builds (when the cache isn't usable) get removed at
+        # interpreter exit.
+        if not tools.is_cached(bridge_lib):
+            weakref.finalize(extern, shutil.rmtree,
+                             os.path.dirname(bridge_lib), ignore_errors=True)
+
+        cls._libraries[key] = (bridge_lib, extern)
+        return cls._libraries[key]
 
     @staticmethod
     def unload_bytes(address, length):
         """ Copies a fixed amount of bytes from a (char *) buffer to a new
         Python bytes() instance and returns the result. """
 
-        char_buffer = (ct.c_char * length).from_address(address)
-        return char_buffer.raw
+        return ct.string_at(address, length)
 
     @staticmethod
     def load_string_ptr(address, data=b"", terminate=False):
@@ -155,13 +249,10 @@ class FuseBridge(object):
         if isinstance(data, str):
             data = data.encode()
 
-        size = len(data) + int(terminate)
-        string = (ct.c_char * size).from_address(address)
-
         if terminate:
-            string.raw = data + b"\x00"
-        else:
-            string.raw = data
+            data += b"\x00"
+
+        ct.memmove(address, data, len(data))
 
     def make_string(self, data=b"", terminate=False):
         """ Uses the bridge's allocator to create a new (char *) buffer, and
@@ -171,136 +262,205 @@ class FuseBridge(object):
         Returns an address to the allocated memory. User is responsible for
         freeing the memory when finished. """
 
-        address = self.extern.zalloc(len(data) + int(terminate))
+        size = len(data) + int(terminate)
+        address = self.extern.zalloc(size)
+        if not address and size:
+            raise MemoryError("couldn't allocate string")
+
         self.load_string_ptr(address, data)
         return address
 
     def make_string_array(self, strings=(), string_term=True,
                           array_term=True):
         """ Uses the bridge's allocator to create an array of char pointers,
-        each of which points to a newly-allocated string buffer. This function
-        can be used for creating argv-style lists.
+        each of which points to a string buffer. This function can be used
+        for creating argv-style lists.
 
         Optionally adds a terminating NUL character to each string, and/or a
         terminating NULL address to the end of the list.
 
-        Returns an address to top of the list. User is responsible for freeing
-        all of the memory blocks in the list, as well as the list itself. """
+        The pointer table and all of the strings are laid out in a single
+        allocated block (table first, followed by the string data), which is
+        filled in with one memmove. Returns an address to top of the list.
+        User is responsible for freeing the list (a single zfree() releases
+        everything). """
+
+        terminator = b"\x00" if string_term else b""
+        strings = [(x.encode() if isinstance(x, str) else x) + terminator
+                   for x in strings]
 
         length = len(strings) + int(array_term)
+        table_size = ct.sizeof(ct.c_char_p) * length
+        payload = b"".join(strings)
 
-        address = self.extern.zalloc(ct.sizeof(ct.c_char_p) * length)
-        array = (ct.c_char_p * length).from_address(address)
+        # Every byte is written below, so there's no need to zero it first.
+        size = table_size + len(payload)
+        address = self.extern.ualloc(size)
+        if not address and size:
+            raise MemoryError("couldn't allocate string array")
 
-        for k, string in enumerate(strings):
-            array[k] = self.make_string(string, string_term)
+        pointers = []
+        offset = address + table_size
+        for string in strings:
+            pointers.append(offset)
+            offset += len(string)
 
-        return array
+        if array_term:
+            pointers.append(0)
+
+        block = struct.pack("%dP" % length, *pointers) + payload
+        ct.memmove(address, block, len(block))
+
+        return (ct.c_char_p * length).from_address(address)
 
     def _main(self, argv):
-        """ Internally-launched routine for calling the FUSE event loop. This
-        routine is spawned in a new Process() instance by self.main(), and
-        generally shouldn't be called directly. """
+        """ Internal routine for calling the FUSE event loop. Called by
+        self.main() once signals have been set up, and generally shouldn't
+        be called directly. """
 
         argv = list(argv)
         fuse_opts = ["allow_other", "intr"]
 
         if sys.platform != "darwin":
             fuse_opts += ["direct_io", "auto_unmount"]
+            # Bigger requests spread the per-callback overhead over more data.
+            fuse_opts += ["big_writes", "max_read=131072"]
 
         if sys.platform == "darwin":
             fuse_opts += ["nolocalcaches"]
-            fuse_opts += ["volname=" + os.path.basename(self.mount_point)]
+            if self.mount_point is not None:
+                fuse_opts += ["volname=" + os.path.basename(self.mount_point)]
+
+        # fuse_main() runs in this process, so it has to stay in the
+        # foreground. Daemonizing would fork and _exit() the caller from
+        # inside bridge_main(), skipping main()'s clean-up and atexit.
+        fuse_args = ["-f"]
+        for opt in fuse_opts:
+            fuse_args.extend(("-o", opt))
 
-        fuse_args = [x for pair in [("-o", x) for x in fuse_opts] for x in pair]
+        if self.single_threaded:
+            fuse_args.insert(0, "-s")
 
-        argv = [argv[0], "-s"] + fuse_args + argv[1:]
+        argv = [argv[0]] + fuse_args + argv[1:]
         argc = len(argv)
         argv = self.make_string_array(argv)
 
+        paths = None
+        if self.known_paths is not None:
+            paths = self.make_string_array(self.known_paths)
+
+        tracebacklimit = getattr(sys, "tracebacklimit", None)
         sys.tracebacklimit = 0
-        self.result = self.extern.bridge_main(argc, argv)
+
+        try:
+            self.result = self.extern.bridge_main(argc, argv,
+                                                  ct.byref(self.callbacks),
+                                                  paths)
+        finally:
+            if tracebacklimit is None:
+                del sys.tracebacklimit
+            else:
+                sys.tracebacklimit = tracebacklimit
+
         return self.result
 
     def main(self, argv):
         """ Main routine for launching FUSE bridge after the user has finished
-        connecting callbacks. """
+        connecting callbacks. FUSE runs in the foreground of the calling
+        process, so this returns (with fuse_main()'s result) once the
+        filesystem is unmounted or FUSE is otherwise terminated. """
 
-        skip = False
+        # Don't let a previous call's mount point leak into this one.
+        self.mount_point = None
 
-        for arg in argv[1:]:
-            if skip:
-                skip = False
-                continue
+        try:
+            args, _ = MOUNT_ARGS.parse_known_args(argv[1:])
+        except argparse.ArgumentError:
+            # Leave malformed command lines for fuse_main() to report.
+            args = None
 
-            if arg == '-o':
-                skip = True
-                continue
+        if args is not None and args.mountpoint is not None:
+            self.mount_point = os.path.abspath(args.mountpoint)
 
-            if arg[0:1] != '-':
-                self.mount_point = os.path.abspath(arg)
-                break
+        # fuse_main() runs on this thread (ctypes drops the GIL around it),
+        # so Python's own handlers would only get to run on the next
+        # callback. libfuse installs handlers that cleanly exit the session
+        # and unmount, but only for signals that are still at SIG_DFL.
+        signums = (signal.SIGINT, signal.SIGTERM, signal.SIGHUP)
+        handlers = {x: signal.signal(x, signal.SIG_DFL) for x in signums}
 
-        self.process = multiprocessing.Process(target=self._main, args=(argv,))
-        self.process.start()
+        try:
+            return self._main(argv)
+        finally:
+            for signum, handler in handlers.items():
+                if handler is not None:
+                    signal.signal(signum, handler)
 
-        def cleanup():
-            """ Cleanup callback. Unmounts the FUSE filesystem (on MacOS),
-            terminates the FUSE subprocess, and deletes the temporary
-            helper library. """
 
-            sys.stderr.write("Terminating.\n")
+class BasicFs(object):
+    """ Basic FUSE filesystem class. Provides a full set of wrappers
+    around everything ctypes-specific, which simplifies the end-user's
+    design significantly.
 
-            if (sys.platform == "darwin") and (self.mount_point != ""):
-                try:
-                    #pylint: disable=broad-except
-                    sp.call(["diskutil", "unmount", "force", self.mount_point])
-                except Exception as err:
-                    sys.stderr.write(str(err) + "\n")
+    Paths are passed to the filesystem methods as str by default. Subclasses
+    that set 'bytes_paths' to True get the raw bytes from FUSE instead,
+    which skips a UTF-8 decode on every call.
 
-            self.process.terminate()
-            shutil.rmtree(os.path.dirname(self.bridge_lib), ignore_errors=True)
-            sys.exit(1)
+    Filesystems whose set of paths never changes can set 'known_paths' to
+    a list of all of them (as str or bytes). Lookups of anything else are
+    then rejected in C, without calling the filesystem's methods. """
 
-        register_signal_callback(cleanup, signal.SIGINT)
-        register_signal_callback(cleanup, signal.SIGQUIT)
-        register_signal_callback(cleanup, signal.SIGTERM)
+    bytes_paths = False
+    known_paths = None
 
-        while self.process.is_alive():
-            time.sleep(0.5)
+    def __init__(self):
+        self.bridge = FuseBridge()
 
-        return self.result
+        # access() is only connected if the subclass overrides it. Otherwise
+        # it stays NULL, and libfuse answers it (the kernel caches that
+        # answer) without calling into Python.
+        #pylint: disable=protected-access
+        for name, ptr_type in Callbacks._fields_:
+            if name == "read" and self._overrides("read_into"):
+                wrapper = self._fs_read_into
+            elif name == "access" and not self._overrides(name):
+                continue
+            else:
+                wrapper = getattr(self, "_fs_" + name)
 
+            setattr(self.bridge.callbacks, name, ptr_type(wrapper))
 
-class BasicFs(object):
-    """ Basic FUSE filesystem class. Provides a full set of wrappers
-    around everything ctypes-specific, which simplifies the end-user's
-    design significantly. """
+    def _overrides(self, name):
+        """ Returns True if this filesystem overrides BasicFs's 'name'
+        method. """
 
-    def __init__(self):
-        self.bridge = FuseBridge()
-        self.bridge.callbacks.open = OpenPtrType(self._fs_open)
-        self.bridge.callbacks.readdir = ReadDirPtrType(self._fs_readdir)
-        self.bridge.callbacks.getattr = GetAttrPtrType(self._fs_getattr)
-        self.bridge.callbacks.access = AccessPtrType(self._fs_access)
-        self.bridge.callbacks.read = ReadPtrType(self._fs_read)
-        self.bridge.callbacks.write = WritePtrType(self._fs_write)
-        self.bridge.callbacks.truncate = TruncatePtrType(self._fs_truncate)
+        return getattr(type(self), name) is not getattr(BasicFs, name)
 
     def _fs_open(self, path, info_ptr):
         """ Wraps user-provided open() """
-        return self.open(path.decode(), info_ptr.contents)
+
+        if not self.bytes_paths:
+            path = path.decode()
+
+        return self.open(path, info_ptr.contents)
 
     def _fs_readdir(self, path, target):
         """ Wraps user-provided readdir() """
 
-        result = self.readdir(path.decode())
+        if not self.bytes_paths:
+            path = path.decode()
+
+        result = self.readdir(path)
+        kind = type(result)
+
+        # Exact-type checks first (the common case), isinstance() fallbacks
+        # for subclasses such as namedtuples or IntEnums.
+        if kind is int or (kind is not tuple and isinstance(result, int)):
+            return result
 
-        if isinstance(result, (tuple, list)):
+        if kind is tuple or isinstance(result, (tuple, list)):
             target[0] = self.bridge.make_string_array(result[1])
             return result[0]
-        elif isinstance(result, int):
-            return result
 
         target[0] = self.bridge.make_string_array(result)
         return 0
@@ -308,58 +468,84 @@ class BasicFs(object):
     def _fs_getattr(self, path, attributes_ptr):
         """ Wraps user-provided getattr() """
 
-        result = self.getattr(path.decode())
+        if not self.bytes_paths:
+            path = path.decode()
 
-        if isinstance(result, (tuple, list)):
-            retval, attributes = result
-        elif isinstance(result, int):
+        result = self.getattr(path)
+        kind = type(result)
+
+        if kind is int or (kind is not tuple and isinstance(result, int)):
             return result
+
+        if kind is tuple or isinstance(result, (tuple, list)):
+            retval, attributes = result
         else:
             retval, attributes = 0, result
 
-        #pylint: disable=protected-access
-        for field in attributes._fields_:
-            val = getattr(attributes, field[0])
-            setattr(attributes_ptr.contents, field[0], val)
-
+        ct.memmove(attributes_ptr, ct.byref(attributes), ATTRIBUTES_SIZE)
         return retval
 
     def _fs_access(self, path, mask):
         """ Wraps user-provided access() """
-        return self.access(path.decode(), mask)
+
+        if not self.bytes_paths:
+            path = path.decode()
+
+        return self.access(path, mask)
 
     def _fs_read(self, path, target, size, offset, info_ptr):
         #pylint: disable=too-many-arguments
         """ Wraps user-provided read() """
 
-        result = self.read(path.decode(), size, offset, info_ptr.contents)
+        if not self.bytes_paths:
+            path = path.decode()
 
-        if isinstance(result, (tuple, list)):
+        result = self.read(path, size, offset, info_ptr.contents)
+        kind = type(result)
+
+        if kind is int or (kind is not tuple and isinstance(result, int)):
+            return result
+
+        if kind is tuple or isinstance(result, (tuple, list)):
             self.bridge.load_string_ptr(target, result[1])
             return result[0]
-        elif isinstance(result, int):
-            return result
 
         self.bridge.load_string_ptr(target, result)
         return 0
 
+    def _fs_read_into(self, path, target, size, offset, info_ptr):
+        #pylint: disable=too-many-arguments
+        """ Wraps user-provided read_into() """
+
+        if not self.bytes_paths:
+            path = path.decode()
+
+        return self.read_into(path, target, size, offset, info_ptr.contents)
+
     def _fs_write(self, path, data, size, offset, info_ptr):
         #pylint: disable=too-many-arguments
         """ Wraps user-provided write() """
 
+        if not self.bytes_paths:
+            path = path.decode()
+
         write_data = self.bridge.unload_bytes(data, size)
-        return self.write(path.decode(), write_data, offset, info_ptr.contents)
+        return self.write(path, write_data, offset, info_ptr.contents)
 
     def _fs_truncate(self, path, size):
         """ Wraps user-provided truncate() """
 
-        return self.truncate(path.decode(), size)
+        if not self.bytes_paths:
+            path = path.decode()
+
+        return self.truncate(path, size)
 
     def main(self, argv=()):
         """ Launches FUSE filesystem. Returns when the filesystem is dismounted
         or FUSE is otherwise terminated. """
 
         assert isinstance(argv, (list, tuple))
+        self.bridge.known_paths = self.known_paths
         return self.bridge.main(argv)
 
     def open(self, path, info):
@@ -407,6 +593,17 @@ class BasicFs(object):
         sys.stderr.write("'Read' not implemented in this filesystem.\n")
         return -1, ""
 
+    def read_into(self, path, target, size, offset, info):
+        #pylint: disable=unused-argument, no-self-use, too-many-arguments
+        """ Optional zero-copy version of read(). Writes up to 'size' bytes
+        straight into the buffer at address 'target' (for example with
+        ctypes.memmove(), or os.preadv() into a memoryview of it), and
+        returns the number of bytes written, 0 at EOF, or a negative errno.
+        If a filesystem overrides this, it is called instead of read(). """
+
+        sys.stderr.write("'Read_into' not implemented in this filesystem.\n")
+        return -1
+
     def write(self, path, data, offset, info):
         #pylint: disable=unused-argument, no-self-use, too-many-arguments
         """ Writes some data to a file. Should return the number of bytes